@@ -1,17 +1,33 @@
 import streamlit as st
-from pyvis.network import Network
-import requests
+import asyncio
 import json
+import orjson
+import ijson
+import time
+import random
+import queue
+import threading
 import streamlit.components.v1 as components
 import re
 import html
+import hashlib
+import collections
+import diskcache
+from aiolimiter import AsyncLimiter
 
 # 1. Page configuration
 st.set_page_config(page_title="Literary Nexus", layout="wide")
 
-st.markdown("""
+# One stylesheet URL for the page and the graph iframe, so the browser fetches it once
+GOOGLE_FONTS_URL = "https://fonts.googleapis.com/css2?family=Playfair+Display:wght@400;700&family=Source+Sans+3:wght@300;400;500;600;700&display=swap"
+FONT_LINKS = (
+    '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>'
+    f'<link rel="preload" href="{GOOGLE_FONTS_URL}" as="style">'
+    f'<link rel="stylesheet" href="{GOOGLE_FONTS_URL}">'
+)
+
+st.markdown(FONT_LINKS + """
 <style>
-@import url('https://fonts.googleapis.com/css2?family=Playfair+Display:wght@400;700&family=Source+Sans+3:wght@300;400;600&display=swap');
 html, body, [class*="css"] {
     font-family: 'Source Sans 3', sans-serif;
 }
@@ -56,6 +72,9 @@ except Exception as e:
     """)
     st.stop()
 
+# Built once per run; only the prompt text changes between requests
+GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:streamGenerateContent?alt=sse&key={API_KEY}"
+
 # 4. Sidebar input fields
 with st.sidebar:
     st.header("📚 Book Titles")
@@ -65,75 +84,218 @@ with st.sidebar:
     analyze_btn = st.button("Generate Network")
 
 # 5. Plain-text tooltip generator (no HTML)
+TOOLTIP_TEMPLATE = "{badge}\n\n📚 {title}\n✍️ {author}\n\n💡 Why this book:\n{reason}\n\n📖 Summary:\n{summary}"
+BADGES = {
+    'Seed': "🔴 Your Input Book",
+    'Level2': "🟡 Deep Recommendation",
+}
+DEFAULT_BADGE = "🔵 Recommended Book"
+TOOLTIP_DEFAULTS = {
+    'author': 'Unknown Author',
+    'reason': 'No recommendation reason provided.',
+    'summary': 'No summary available.',
+}
+
 def create_tooltip_text(node_data):
     """Create tooltip using plain text only — no HTML."""
-    book_title = node_data.get('title') or node_data.get('id') or "Untitled"
-    author = node_data.get('author', 'Unknown Author')
-    reason = node_data.get('reason', 'No recommendation reason provided.')
-    summary = node_data.get('summary', 'No summary available.')
-    group = node_data.get('group', 'Recommended')
-
-    if group == 'Seed':
-        badge = "🔴 Your Input Book"
-    elif group == 'Level2':
-        badge = "🟡 Deep Recommendation"
-    else:
-        badge = "🔵 Recommended Book"
-
-    # Pure text tooltip
-    tooltip = f"{badge}\n\n📚 {book_title}\n✍️ {author}\n\n💡 Why this book:\n{reason}\n\n📖 Summary:\n{summary}"
-
-    return tooltip
+    return TOOLTIP_TEMPLATE.format_map(collections.ChainMap(
+        {
+            'badge': BADGES.get(node_data.get('group', 'Recommended'), DEFAULT_BADGE),
+            'title': node_data.get('title') or node_data.get('id') or "Untitled",
+        },
+        node_data,
+        TOOLTIP_DEFAULTS,
+    ))
 
 # 6. JSON extraction helper
+JSON_RE = re.compile(r'\{[\s\S]*\}|\[[\s\S]*\]')
+
 def extract_json(text):
+    s = text.strip()
+    if not s.startswith(('{', '[')):
+        # Unwrap a ```json ... ``` fence in a single pass
+        _, fence, rest = s.partition('```')
+        if fence:
+            rest = rest[4:] if rest.startswith('json') else rest
+            s = rest.partition('```')[0].strip() or s
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
+        return orjson.loads(s)
+    except orjson.JSONDecodeError:
         pass
     try:
-        match = re.search(r'(\{[\s\S]*\}|\[[\s\S]*\])', text)
+        match = JSON_RE.search(s)
         if match:
-            return json.loads(match.group(0))
+            return orjson.loads(match.group(0))
     except Exception:
         pass
     return None
 
 # 7. Graph generation logic (refined prompt)
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def get_recommendations(books):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={API_KEY}"
+# Response schema: Gemini returns strictly parseable JSON instead of free text
+GRAPH_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "nodes": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "STRING"},
+                    "title": {"type": "STRING"},
+                    "author": {"type": "STRING"},
+                    "group": {"type": "STRING", "enum": ["Seed", "Recommended", "Level2"]},
+                    "summary": {"type": "STRING"},
+                    "reason": {"type": "STRING"}
+                },
+                "required": ["id", "title", "author", "group", "summary", "reason"],
+                "propertyOrdering": ["id", "title", "author", "group", "summary", "reason"]
+            }
+        },
+        "edges": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "source": {"type": "STRING"},
+                    "target": {"type": "STRING"},
+                    "label": {"type": "STRING"}
+                },
+                "required": ["source", "target", "label"],
+                "propertyOrdering": ["source", "target", "label"]
+            }
+        }
+    },
+    "required": ["nodes", "edges"],
+    "propertyOrdering": ["nodes", "edges"]
+}
+
+GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": GRAPH_SCHEMA
+}
+
+def build_payload(prompt):
+    return {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": GENERATION_CONFIG}
+
+class GraphStream:
+    """Pull complete node/edge objects out of the JSON text as it streams in."""
+
+    def __init__(self, on_item):
+        self.on_item = on_item
+        self.events = ijson.sendable_list()
+        self.parser = ijson.parse_coro(self.events)
+        self.builder = None
+        self.prefix = None
+        self.broken = False
+
+    def feed(self, text):
+        if self.broken:
+            return
+        try:
+            self.parser.send(text.encode())
+        except ijson.JSONError:
+            # Not clean JSON (e.g. fenced); the final extract_json pass still handles it
+            self.broken = True
+            return
+
+        for prefix, event, value in self.events:
+            if self.builder is None:
+                if prefix in ('nodes.item', 'edges.item') and event == 'start_map':
+                    self.prefix = prefix
+                    self.builder = ijson.ObjectBuilder()
+                    self.builder.event(event, value)
+                continue
+
+            self.builder.event(event, value)
+            if prefix == self.prefix and event == 'end_map':
+                self.on_item(self.prefix.split('.')[0], self.builder.value)
+                self.builder = None
+        del self.events[:]
+
+async def stream_text(client, payload, emit):
+    """Read Gemini's SSE stream and return the concatenated response text."""
+    stream = GraphStream(emit)
+    chunks = []
+
+    async with client.stream("POST", GEMINI_URL, json=payload) as response:
+        response.raise_for_status()
+
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            result = orjson.loads(line[5:])
+
+            for candidate in result.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    text = part.get('text')
+                    if text:
+                        chunks.append(text)
+                        stream.feed(text)
+
+    return "".join(chunks)
 
-    prompt = f"""
+async def fetch_graph(client, semaphore, limiter, prompt, emit):
+    """POST one prompt to Gemini and return the parsed graph dict."""
+    import httpx
+    payload = build_payload(prompt)
+
+    # Retry logic (429 included: with backoff it is safe to try again)
+    max_retries = 3
+
+    for attempt in range(max_retries):
+        try:
+            # Every attempt, retries included, draws from the shared QPM budget
+            async with semaphore, limiter:
+                raw_text = await stream_text(client, payload, emit)
+
+            if raw_text:
+                # Schema-enforced output, so this is a single orjson.loads in practice
+                return extract_json(raw_text)
+            else:
+                return None
+
+        except Exception as e:
+            if attempt < max_retries - 1:
+                # Exponential backoff with jitter so concurrent retries don't land together
+                await asyncio.sleep(min(2 ** (attempt + 1), 30) + random.uniform(0, 1))
+                continue
+
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                emit('error', "⏳ API rate limit exceeded (429 error). Please wait and try again.")
+            else:
+                emit('error', f"❌ Communication error: {e}")
+            return None
+
+    return None
+
+# Prompt templates, filled with str.format per request
+SEED_PROMPT = """
     [Role]
     You are a 'Literary Curator' who analyzes texts by their 'Style', 'Philosophy', and 'Mood' to draw a precise reading map.
 
-    [Input Books (Seeds)]
-    The user has provided these 3 books as seeds: {books}
+    [Input Book (Seed)]
+    The user has provided this book as a seed: "{book}"
 
     [⚠️ Core Constraints (Strict Rules)]
     1. **Real Books Only**: Only recommend books that genuinely exist and are verifiable (e.g., searchable on Amazon or Goodreads). Never invent or hallucinate titles.
-    2. **Accuracy Over Quantity**: Do NOT force 3–4 recommendations per Seed. Only recommend books you are 100% certain exist. If only 1 book qualifies, recommend 1.
+    2. **Accuracy Over Quantity**: Do NOT force 3–4 recommendations. Only recommend books you are 100% certain exist. If only 1 book qualifies, recommend 1.
     3. **Correct Attribution**: Match author names to book titles accurately.
 
     [Reasoning Process]
-    1. **Extract DNA**: Identify core attribute keywords — shared or unique — across the 3 seed books.
+    1. **Extract DNA**: Identify the core attribute keywords of the seed book.
     2. **Target Search**: Select recommended books that powerfully embody those keywords.
-    3. **Build the Network**:
-        - Connect each recommended book to its parent Seed book.
-        - Also connect recommended books to each other if they share strong commonalities.
+    3. **Build the Network**: Connect each recommended book to the Seed book.
 
     [Data Rules]
     1. **Groups**:
-        - Seed: The 3 user-provided books
-        - Recommended: Primary recommendations (1–4 per Seed, real books only)
-        - Level2: Derived recommendations (0–3 total, real books only)
+        - Seed: The user-provided book. Use exactly "{book}" as its id.
+        - Recommended: Primary recommendations (1–4, real books only)
     2. **Edges**:
-        - Every recommended book must be connected to its source Seed book.
+        - Every recommended book must be connected to the Seed book.
         - Edge label: A specific shared keyword linking the two books.
     3. **Text Content**:
         - **summary**: Core plot in 2–3 sentences.
-        - **reason**: Explain specifically why this book connects to the input books (e.g., "Like [Seed Book], this novel explores [keyword] through a strikingly similar lens.").
+        - **reason**: Explain specifically why this book connects to the seed book (e.g., "Like [Seed Book], this novel explores [keyword] through a strikingly similar lens.").
 
     [JSON Format — Output this format ONLY]
     {{
@@ -150,48 +312,291 @@ def get_recommendations(books):
 
     Important: Output only valid JSON. Do not include markdown code fences or any explanatory text.
     """
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
 
-    # Retry logic
-    max_retries = 3
-    retry_delays = [2, 5, 10]
+LINK_PROMPT = """
+    [Role]
+    You are a 'Literary Curator' who analyzes texts by their 'Style', 'Philosophy', and 'Mood' to draw a precise reading map.
 
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload, timeout=60)
+    [Current Reading Map]
+    Seed books: {books}
+    Books already on the map: {existing}
 
-            if response.status_code == 429:
-                st.error("⏳ API rate limit exceeded (429 error). Please wait and try again.")
-                return None
+    [⚠️ Core Constraints (Strict Rules)]
+    1. **Real Books Only**: Only recommend books that genuinely exist and are verifiable (e.g., searchable on Amazon or Goodreads). Never invent or hallucinate titles.
+    2. **Accuracy Over Quantity**: Only recommend books you are 100% certain exist. Recommending none is acceptable.
+    3. **Correct Attribution**: Match author names to book titles accurately.
 
-            if response.status_code == 503 and attempt < max_retries - 1:
-                import time
-                time.sleep(retry_delays[attempt])
+    [Task]
+    1. **Cross Links**: Connect books already on the map to each other if they share strong commonalities.
+    2. **Deep Recommendations**: Add 0–3 Level2 books derived from the Recommended books, each connected to the book it was derived from.
+
+    [Data Rules]
+    1. **nodes**: Only the NEW Level2 books (group "Level2"). Never repeat a book already on the map.
+    2. **edges**: Use the exact ids listed above (or of your new Level2 books) as source and target.
+        - Edge label: A specific shared keyword linking the two books.
+    3. **Text Content**:
+        - **summary**: Core plot in 2–3 sentences.
+        - **reason**: Explain specifically why this book connects to the input books.
+
+    Important: Output only valid JSON. Do not include markdown code fences or any explanatory text.
+    """
+
+async def expand_seed(client, semaphore, limiter, book, emit):
+    """Ask for the primary recommendations of a single seed book."""
+    prompt = SEED_PROMPT.format(book=book)
+    return await fetch_graph(client, semaphore, limiter, prompt, emit)
+
+async def link_recommendations(client, semaphore, limiter, books, graph, emit):
+    """Ask for Level2 books and cross-edges on top of the merged seed graphs."""
+    existing = [
+        {"id": n.get('id'), "author": n.get('author'), "group": n.get('group')}
+        for n in graph['nodes']
+    ]
+    prompt = LINK_PROMPT.format(books=books, existing=json.dumps(existing, ensure_ascii=False))
+    return await fetch_graph(client, semaphore, limiter, prompt, emit)
+
+def merge_graphs(graphs):
+    """Merge partial graphs into one, keeping the first node seen per id."""
+    nodes = {}
+    edges = []
+    for graph in graphs:
+        if not isinstance(graph, dict):
+            continue
+        for node in graph.get('nodes', []):
+            node_id = node.get('id') or node.get('title')
+            if node_id and node_id not in nodes:
+                nodes[node_id] = node
+        edges.extend(graph.get('edges', []))
+    return {'nodes': list(nodes.values()), 'edges': edges}
+
+async def build_graph(client, limiter, books, emit):
+    semaphore = asyncio.Semaphore(3)  # At most three requests in flight per query
+
+    seed_graphs = await asyncio.gather(
+        *[expand_seed(client, semaphore, limiter, book, emit) for book in books]
+    )
+    missing = [book for book, seed_graph in zip(books, seed_graphs) if seed_graph is None]
+    graph = merge_graphs(seed_graphs)
+    if not graph['nodes']:
+        return None, missing, False
+
+    links = await link_recommendations(client, semaphore, limiter, books, graph, emit)
+    # Only a graph built from every call is complete enough to cache
+    complete = not missing and links is not None
+    return merge_graphs([graph, links]), missing, complete
+
+GEMINI_RPM = 14  # Requests per minute, just under the free-tier limit
+
+@st.cache_resource
+def get_http_runtime():
+    """Background event loop owning the HTTP/2 client and rate limiter shared by every query."""
+    import httpx  # Lazy: not needed until the first "Generate Network" click
+
+    # A long-lived client keeps its pooled connections across queries and
+    # retries, so only the first request pays the TCP+TLS handshake.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="gemini-http", daemon=True).start()
+    client = httpx.AsyncClient(http2=True, timeout=60, headers={"content-type": "application/json"})
+    # Token bucket below Gemini's free-tier 15 RPM. It lives on this one loop,
+    # so it also covers concurrent sessions sharing the API key.
+    limiter = AsyncLimiter(max_rate=GEMINI_RPM, time_period=60)
+    return loop, client, limiter
+
+# Persistent graph cache: graphs are effectively static per input triple
+PROMPT_VERSION = "v1"  # Bump whenever the prompts change to invalidate cached graphs
+CACHE_TTL = 7 * 86400  # 7 days
+MEMORY_CACHE_SIZE = 128
+MEMORY_CACHE_TTL = 3600  # 1 hour, as with the former st.cache_data L1
+
+@st.cache_resource
+def get_disk_cache():
+    return diskcache.Cache(".cache/nextchapter")
+
+@st.cache_resource
+def get_memory_cache():
+    # In-process L1 in front of the disk cache. st.cache_data can't be used
+    # here: streamed progress updates a placeholder created outside the
+    # function, which Streamlit refuses to replay. Shared by every session
+    # thread, hence the lock.
+    return threading.Lock(), collections.OrderedDict()
+
+def cache_key(books):
+    """Order-, case- and whitespace-insensitive key for a set of seed books."""
+    normalized = sorted(b.strip().casefold() for b in books)
+    return hashlib.sha1(json.dumps([PROMPT_VERSION, normalized]).encode()).hexdigest()
+
+def get_recommendations(books, on_item=None):
+    """Return (graph, missing_seeds), calling on_item(kind, item) as nodes/edges stream in."""
+    lock, memory = get_memory_cache()
+    cache = get_disk_cache()
+    key = cache_key(books)
+
+    with lock:
+        entry = memory.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1], []
+
+    def remember(value):
+        with lock:
+            memory.pop(key, None)
+            memory[key] = (time.monotonic() + MEMORY_CACHE_TTL, value)
+            while len(memory) > MEMORY_CACHE_SIZE:
+                memory.popitem(last=False)
+
+    data = cache.get(key)
+    if data is not None:
+        remember(data)
+        return data, []
+
+    loop, client, limiter = get_http_runtime()
+
+    # Streamlit calls must stay on the script thread, so the request
+    # coroutine only queues events and they are replayed here.
+    events = queue.SimpleQueue()
+
+    def emit(kind, item):
+        events.put((kind, item))
+
+    future = asyncio.run_coroutine_threadsafe(build_graph(client, limiter, books, emit), loop)
+    try:
+        while not (future.done() and events.empty()):
+            try:
+                kind, item = events.get(timeout=0.05)
+            except queue.Empty:
                 continue
+            if kind == 'error':
+                st.error(item)
+            elif on_item:
+                on_item(kind, item)
+    finally:
+        future.cancel()  # No-op once done; stops the request if the rerun was interrupted
+
+    data, missing, complete = future.result()
+    if data and complete:
+        cache.set(key, data, expire=CACHE_TTL)
+        remember(data)
+    return data, missing
 
-            response.raise_for_status()
-            result = response.json()
+# 8. Pyvis visualization + custom tooltips
+# Physics engine options, parsed once instead of via net.set_options() per render
+NET_OPTIONS = json.loads("""
+{
+  "nodes": {
+    "font": {
+      "size": 16,
+      "face": "Source Sans 3",
+      "color": "#000000",
+      "strokeWidth": 3,
+      "strokeColor": "#ffffff",
+      "bold": true
+    },
+    "borderWidth": 2,
+    "borderWidthSelected": 4,
+    "shadow": {
+      "enabled": true,
+      "size": 10
+    }
+  },
+  "edges": {
+    "color": { "color": "#666666", "inherit": false },
+    "width": 2,
+    "smooth": {
+      "type": "continuous",
+      "roundness": 0.5
+    },
+    "font": {
+      "size": 12,
+      "face": "Source Sans 3",
+      "align": "middle",
+      "background": "#ffffff",
+      "strokeWidth": 0,
+      "bold": true
+    },
+    "arrows": {
+      "to": {
+        "enabled": false
+      }
+    }
+  },
+  "physics": {
+    "enabled": true,
+    "solver": "forceAtlas2Based",
+    "forceAtlas2Based": {
+      "gravitationalConstant": -200,
+      "centralGravity": 0.01,
+      "springLength": 350,
+      "springConstant": 0.02,
+      "damping": 0.7,
+      "avoidOverlap": 1
+    },
+    "stabilization": {
+      "enabled": true,
+      "iterations": 200
+    }
+  },
+  "interaction": {
+    "hover": true,
+    "tooltipDelay": 50,
+    "hideEdgesOnDrag": false,
+    "hideEdgesOnZoom": false
+  }
+}
+""")
 
-            if 'candidates' in result and result['candidates']:
-                raw_text = result['candidates'][0]['content']['parts'][0]['text']
-                cleaned_text = raw_text.replace("```json", "").replace("```", "").strip()
-                data = extract_json(cleaned_text)
-                return data
-            else:
-                return None
+# Font links + custom tooltip styles, injected right before </head>
+CUSTOM_STYLE = FONT_LINKS + """
+<style>
+div.vis-tooltip {
+    font-family: 'Source Sans 3', sans-serif !important;
+    background: linear-gradient(135deg, #ffffff 0%, #f8f9fa 100%) !important;
+    color: #000000 !important;
+    border: 2px solid #e0e0e0 !important;
+    border-radius: 16px !important;
+    padding: 20px !important;
+    box-shadow: 0 10px 40px rgba(0,0,0,0.15) !important;
+    max-width: 380px !important;
+    font-size: 14px !important;
+    line-height: 1.7 !important;
+    white-space: pre-wrap !important;
+    word-wrap: break-word !important;
+    z-index: 999999 !important;
+    pointer-events: none !important;
+}
 
-        except Exception as e:
-            if attempt < max_retries - 1:
-                import time
-                time.sleep(retry_delays[attempt])
-            else:
-                st.error(f"❌ Communication error: {e}")
-                return None
+canvas {
+    outline: none !important;
+}
+</style>
+"""
 
-    return None
+# Node (color, size) per group
+GROUP_STYLE = {
+    'Seed': ("#FF6B6B", 50),
+    'Level2': ("#FFD93D", 25),
+}
+DEFAULT_STYLE = ("#4ECDC4", 35)
+
+# The whole document is inlined into the iframe on every render, so strip
+# template indentation/comments and the Bootstrap JS bundle (only used by
+# Pyvis's select/filter menus, which are disabled here)
+HTML_COMMENT_RE = re.compile(r'<!--[\s\S]*?-->')
+HTML_INDENT_RE = re.compile(r'\n\s+')
+BOOTSTRAP_JS_RE = re.compile(r'<script\s+src="[^"]*bootstrap\.bundle\.min\.js"[^>]*>\s*</script>')
+
+def minify_html(content):
+    content = HTML_COMMENT_RE.sub('', content)
+    content = BOOTSTRAP_JS_RE.sub('', content)
+    return HTML_INDENT_RE.sub('\n', content)
+
+def normalize_id(value):
+    return str(value or '').strip().casefold()
+
+def hash_graph(graph):
+    return hashlib.sha1(orjson.dumps(graph, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+def render_network(data):
+    from pyvis.network import Network  # Lazy: pulls in Jinja2/networkx; only needed once a graph exists
 
-# 8. Pyvis visualization + custom tooltips
-def visualize_network(data):
     net = Network(height="750px", width="100%", bgcolor="#ffffff", font_color="#000000")
 
     if isinstance(data, list):
@@ -199,73 +604,12 @@ def visualize_network(data):
     if not isinstance(data, dict) or 'nodes' not in data:
         return None
 
-    # Physics engine options
-    options = """
-    {
-      "nodes": {
-        "font": {
-          "size": 16,
-          "face": "Source Sans 3",
-          "color": "#000000",
-          "strokeWidth": 3,
-          "strokeColor": "#ffffff",
-          "bold": true
-        },
-        "borderWidth": 2,
-        "borderWidthSelected": 4,
-        "shadow": {
-          "enabled": true,
-          "size": 10
-        }
-      },
-      "edges": {
-        "color": { "color": "#666666", "inherit": false },
-        "width": 2,
-        "smooth": {
-          "type": "continuous",
-          "roundness": 0.5
-        },
-        "font": {
-          "size": 12,
-          "face": "Source Sans 3",
-          "align": "middle",
-          "background": "#ffffff",
-          "strokeWidth": 0,
-          "bold": true
-        },
-        "arrows": {
-          "to": {
-            "enabled": false
-          }
-        }
-      },
-      "physics": {
-        "enabled": true,
-        "solver": "forceAtlas2Based",
-        "forceAtlas2Based": {
-          "gravitationalConstant": -200,
-          "centralGravity": 0.01,
-          "springLength": 350,
-          "springConstant": 0.02,
-          "damping": 0.7,
-          "avoidOverlap": 1
-        },
-        "stabilization": {
-          "enabled": true,
-          "iterations": 200
-        }
-      },
-      "interaction": {
-        "hover": true,
-        "tooltipDelay": 50,
-        "hideEdgesOnDrag": false,
-        "hideEdgesOnZoom": false
-      }
-    }
-    """
-    net.set_options(options)
+    net.options = NET_OPTIONS  # Pre-parsed dict; Pyvis serializes it as-is
 
-    # Add nodes
+    # Add nodes (appended straight to net.nodes: add_node scans the list per call).
+    # The LLM may repeat a book across seeds with different casing/spacing,
+    # so nodes are deduplicated on a normalized id.
+    seen = {}  # normalized id -> node id used in the graph
     for node in data.get('nodes', []):
         node_id = node.get('id')
         node_label = node.get('title') or str(node_id)
@@ -274,81 +618,76 @@ def visualize_network(data):
             node_id = node_label
             node['id'] = node_id
 
-        group = node.get('group', 'Recommended')
-
-        if group == 'Seed':
-            color = "#FF6B6B"
-            size = 50
-        elif group == 'Level2':
-            color = "#FFD93D"
-            size = 25
-        else:
-            color = "#4ECDC4"
-            size = 35
-
-        tooltip_text = create_tooltip_text(node)
-
-        net.add_node(
-            node_id,
-            label=node_label,
-            title=tooltip_text,  # Plain text only
-            color=color,
-            size=size
-        )
-
-    # Add edges
+        key = normalize_id(node_id)
+        if not key or key in seen:
+            continue
+        seen[key] = node_id
+
+        color, size = GROUP_STYLE.get(node.get('group', 'Recommended'), DEFAULT_STYLE)
+
+        net.nodes.append({
+            "id": node_id,
+            "label": node_label,
+            "title": create_tooltip_text(node),  # Plain text only
+            "color": color,
+            "size": size,
+            "shape": "dot",
+            "font": {"color": net.font_color}
+        })
+
+    # Add edges (partial graphs may reference nodes that haven't streamed in yet)
+    seen_edges = set()
     for edge in data.get('edges', []):
-        source = edge.get('source')
-        target = edge.get('target')
+        source = seen.get(normalize_id(edge.get('source')))
+        target = seen.get(normalize_id(edge.get('target')))
         label = edge.get('label', 'Related')
 
-        if source and target:
-            net.add_edge(source, target, label=label, title=label)
+        if source is None or target is None:
+            continue
+        key = frozenset((source, target))  # Undirected: A-B and B-A are the same edge
+        if key in seen_edges:
+            continue
+        seen_edges.add(key)
+
+        net.edges.append({"from": source, "to": target, "label": label, "title": label})
 
     # Generate HTML and inject custom CSS
     try:
-        path = "tmp_network.html"
-        net.save_graph(path)
-        with open(path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-
-        # Custom tooltip styles
-        custom_style = """
-        <style>
-        @import url('https://fonts.googleapis.com/css2?family=Playfair+Display:wght@400;700&family=Source+Sans+3:wght@400;500;600;700&display=swap');
-
-        div.vis-tooltip {
-            font-family: 'Source Sans 3', sans-serif !important;
-            background: linear-gradient(135deg, #ffffff 0%, #f8f9fa 100%) !important;
-            color: #000000 !important;
-            border: 2px solid #e0e0e0 !important;
-            border-radius: 16px !important;
-            padding: 20px !important;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.15) !important;
-            max-width: 380px !important;
-            font-size: 14px !important;
-            line-height: 1.7 !important;
-            white-space: pre-wrap !important;
-            word-wrap: break-word !important;
-            z-index: 999999 !important;
-            pointer-events: none !important;
-        }
+        # Render in memory: no shared temp file between concurrent sessions
+        html_content = net.generate_html(notebook=False)
 
-        canvas {
-            outline: none !important;
-        }
-        </style>
-        """
-
-        final_html = html_content.replace('</head>', f'{custom_style}</head>')
-        return final_html
+        final_html = html_content.replace('</head>', f'{CUSTOM_STYLE}</head>')
+        return minify_html(final_html)
 
     except Exception as e:
         st.error(f"Error generating HTML: {e}")
         return None
 
+# Deterministic in the graph, so showing the same graph again reuses the HTML.
+# Progressive redraws call render_network directly to keep partial graphs out.
+@st.cache_data(ttl=3600, hash_funcs={dict: hash_graph})
+def visualize_network(data):
+    return render_network(data)
+
 # 9. Main execution
-if analyze_btn and book1 and book2 and book3:
+RENDER_INTERVAL = 0.2  # Seconds between progressive graph redraws
+
+if analyze_btn:
+    # Validate before touching the LLM: blank or repeated titles are no-ops
+    books = [b.strip() for b in (book1, book2, book3)]
+    if not all(books):
+        st.warning("Please enter all three book titles.")
+        st.stop()
+
+    # Drop case-insensitive repeats so no seed is expanded twice
+    unique = {}
+    for b in books:
+        unique.setdefault(b.casefold(), b)
+    books = list(unique.values())
+    if len(books) < 2:
+        st.warning("Please provide at least two distinct titles.")
+        st.stop()
+
     # Clear the description placeholder
     desc_placeholder.empty()
 
@@ -364,9 +703,24 @@ if analyze_btn and book1 and book2 and book3:
         unsafe_allow_html=True
     )
 
+    # Render the graph progressively as nodes stream in (throttled)
+    graph_placeholder = st.empty()
+    partial = {'nodes': [], 'edges': []}
+    last_render = [0.0]
+
+    def show_partial(kind, item):
+        partial[kind].append(item)
+        now = time.monotonic()
+        if kind == 'nodes' and now - last_render[0] >= RENDER_INTERVAL:
+            last_render[0] = now
+            partial_html = render_network(merge_graphs([partial]))
+            if partial_html:
+                with graph_placeholder.container():
+                    components.html(partial_html, height=770)
+
     # Run AI analysis with spinner
     with st.spinner("AI analysis in progress..."):
-        data = get_recommendations([book1, book2, book3])
+        data, missing = get_recommendations(books, on_item=show_partial)
 
     # Clear loading message once done
     msg_placeholder.empty()
@@ -374,13 +728,20 @@ if analyze_btn and book1 and book2 and book3:
     # Display results
     if data:
         if not data.get('edges'):
+            graph_placeholder.empty()
             st.error("❌ The AI could not generate connections (edges). Please try again.")
         else:
             final_html = visualize_network(data)
             if final_html:
-                components.html(final_html, height=770)
-                st.success("✅ Analysis complete! Hover over the nodes to explore 📚")
+                with graph_placeholder.container():
+                    components.html(final_html, height=770)
+                if missing:
+                    st.warning(f"⚠️ Partial map: no recommendations for {', '.join(missing)}. Please try again in a moment.")
+                else:
+                    st.success("✅ Analysis complete! Hover over the nodes to explore 📚")
             else:
+                graph_placeholder.empty()
                 st.error("Failed to generate visualization.")
     else:
+        graph_placeholder.empty()
         st.error("No response from AI. Please wait a moment and try again.")